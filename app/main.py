@@ -1,15 +1,21 @@
+import io
 import os
-import json
 import time
-from typing import Dict, Optional, Set
+import asyncio
+import threading
+from typing import Dict, FrozenSet, Iterator, Optional, Set
 
+import orjson
+from cachetools import TTLCache
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.requests import Request
 
-from srtxlate import translate_srt_with_progress, target_suffix_for_filename, normalize_lang_code
+from srtxlate import (
+    translate_srt_with_progress, target_suffix_for_filename, normalize_lang_code, make_http_session,
+)
 
 APP_TITLE = "SRT Translator (NLLB-200)"
 
@@ -21,10 +27,17 @@ LIBRE_API_KEY = os.getenv("LIBRE_API_KEY", "")
 
 # In-memory progress store for tracking translation progress
 # Maps progress_key -> {"total": int, "done": int, "ts": timestamp, "finished": bool}
-PROGRESS: Dict[str, Dict[str, float]] = {}
+# Entries expire on their own after the TTL; maxsize caps memory.
 PROGRESS_TTL_SEC = 1800  # 30 minutes TTL for progress entries
+PROGRESS: "TTLCache[str, Dict[str, float]]" = TTLCache(maxsize=10_000, ttl=PROGRESS_TTL_SEC)
+# /translate writes from the threadpool while SSE reads on the event loop
+_PROGRESS_LOCK = threading.Lock()
+# asyncio.Events of the SSE streams watching each key (one per stream, so a second
+# tab or an EventSource reconnect on the same key gets its own); only touched on
+# the event loop, set whenever that key's progress changes
+PROGRESS_EVENTS: Dict[str, Set[asyncio.Event]] = {}
 
-app = FastAPI(title=APP_TITLE)
+app = FastAPI(title=APP_TITLE, default_response_class=ORJSONResponse)
 
 # Mount static directory for assets (e.g., flores200.json for language list)
 if not os.path.isdir("static"):
@@ -33,23 +46,38 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 templates = Jinja2Templates(directory="templates")
 
+# One pooled HTTP session for the NLLB/Libre backends, shared by all requests
+# so batches reuse keep-alive connections instead of reconnecting per POST.
+@app.on_event("startup")
+def _open_http_session() -> None:
+    app.state.http = make_http_session()
+
+# Event loop that serves SSE; captured so threadpool code can wake SSE streams
+@app.on_event("startup")
+async def _capture_event_loop() -> None:
+    app.state.loop = asyncio.get_running_loop()
+
+@app.on_event("shutdown")
+def _close_http_session() -> None:
+    app.state.http.close()
+
 # Load FLORES-200 language list for UI dropdowns
 FLORES_LIST = []
-FLORES_CODES: Set[str] = set()
+FLORES_CODES: FrozenSet[str] = frozenset()
 FLORES_BY_CODE: Dict[str, str] = {}
 def _load_flores_json():
     global FLORES_LIST, FLORES_CODES, FLORES_BY_CODE
     path = os.path.join("static", "flores200.json")
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            FLORES_LIST = json.load(f) or []
-        FLORES_CODES = {entry.get("code", "") for entry in FLORES_LIST if entry.get("code")}
+        with open(path, "rb") as f:
+            FLORES_LIST = orjson.loads(f.read()) or []
+        FLORES_CODES = frozenset(entry["code"] for entry in FLORES_LIST if entry.get("code"))
         FLORES_BY_CODE = {entry.get("code"): entry.get("name", entry.get("code")) 
                           for entry in FLORES_LIST if entry.get("code")}
     except Exception as exc:
         # If the JSON can't be loaded, we proceed without the list (UI will handle missing list)
         FLORES_LIST = []
-        FLORES_CODES = set()
+        FLORES_CODES = frozenset()
         FLORES_BY_CODE = {}
         print(f"[WARN] Could not load flores200.json: {exc}")
 
@@ -59,22 +87,47 @@ _load_flores_json()
 def _set_progress(key: str, total: int, done: int, finished: bool = False) -> None:
     if not key:
         return
-    PROGRESS[key] = {
+    entry = {
         "total": int(max(total, 0)),
         "done": int(max(min(done, total), 0)),
         "ts": time.time(),
         "finished": bool(finished),
     }
+    with _PROGRESS_LOCK:
+        PROGRESS[key] = entry
+    _notify_progress(key)
+
+def _notify_progress(key: str) -> None:
+    """Wake every SSE stream watching key (safe to call from any thread)."""
+    loop = getattr(app.state, "loop", None)
+    if key in PROGRESS_EVENTS and loop is not None:
+        loop.call_soon_threadsafe(_wake_streams, key)
+
+def _wake_streams(key: str) -> None:
+    # runs on the event loop, which is the only place PROGRESS_EVENTS changes
+    for evt in PROGRESS_EVENTS.get(key, ()):
+        evt.set()
 
 def _get_progress(key: str) -> Optional[Dict[str, float]]:
-    return PROGRESS.get(key)
+    with _PROGRESS_LOCK:
+        return PROGRESS.get(key)
 
-def _gc_progress() -> None:
-    """Clean up stale progress entries to free memory."""
-    now = time.time()
-    stale_keys = [k for k, v in PROGRESS.items() if now - v.get("ts", 0) > PROGRESS_TTL_SEC]
-    for k in stale_keys:
-        PROGRESS.pop(k, None)
+# Download bodies are encoded and sent piecewise rather than as one big bytes object
+DOWNLOAD_CHUNK_CHARS = 64 * 1024
+
+def _iter_utf8_chunks(text: str, size: int = DOWNLOAD_CHUNK_CHARS) -> Iterator[bytes]:
+    """Yield text as UTF-8, encoding one slice of characters at a time."""
+    for i in range(0, len(text), size):
+        yield text[i : i + size].encode("utf-8")
+
+# SSE frames carry only ints/bools, so format them directly instead of json.dumps.
+# Frames are bytes so StreamingResponse can send them without re-encoding each tick.
+_SSE_FRAME_FMT = b'data: {"total":%d,"done":%d,"remaining":%d,"finished":%s}\n\n'
+
+def _sse_frame(total: int, done: int, remaining: int, finished: bool) -> bytes:
+    return _SSE_FRAME_FMT % (total, done, remaining, b"true" if finished else b"false")
+
+_SSE_INITIAL_FRAME = _sse_frame(0, 0, 0, False)
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -104,19 +157,23 @@ def translate(
       - engine: translation engine ('auto', 'nllb', 'libre', or 'argos')
       - progress_key: unique key to track progress via SSE
     """
+    # Reject non-SRT uploads before decoding or translating anything
+    if file.filename and not file.filename.lower().endswith(".srt"):
+        raise HTTPException(status_code=400, detail="Only .srt files are supported.")
+
     # Normalize input language codes (aliases to FLORES codes)
     source_norm = normalize_lang_code(source)
     target_norm = normalize_lang_code(target)
-    if FLORES_CODES:
-        # If we have a list of supported codes, validate the requested languages
+    # If we have a list of supported codes, validate the requested languages
+    # (a single superset check on the happy path; which one failed is worked out only on error)
+    if FLORES_CODES and not FLORES_CODES.issuperset((source_norm, target_norm)):
         if source_norm not in FLORES_CODES:
             raise HTTPException(status_code=400, detail=f"Unsupported source language: {source}")
-        if target_norm not in FLORES_CODES:
-            raise HTTPException(status_code=400, detail=f"Unsupported target language: {target}")
+        raise HTTPException(status_code=400, detail=f"Unsupported target language: {target}")
 
-    # Read and decode the uploaded SRT file
-    data = file.file.read()
-    srt_in = data.decode("utf-8", errors="replace")
+    # Decode the upload straight from its spooled temp file; cues are parsed as
+    # lines are read, so the file is never held in memory as one bytes/str blob
+    srt_in = io.TextIOWrapper(file.file, encoding="utf-8", errors="replace")
 
     # Progress callback to update the progress dictionary
     def on_progress(total_lines: int, done_lines: int) -> None:
@@ -126,17 +183,22 @@ def translate(
     _set_progress(progress_key, 0, 0, finished=False)
 
     # Perform the translation with progress tracking
-    srt_out = translate_srt_with_progress(
-        srt_in,
-        source=source_norm,
-        target=target_norm,
-        engine=engine or DEFAULT_ENGINE,
-        nllb_endpoint=NLLB_ENDPOINT,
-        libre_endpoint=LIBRE_ENDPOINT,
-        libre_api_key=LIBRE_API_KEY,
-        progress_cb=on_progress,
-        batch_size=64,
-    )
+    try:
+        srt_out = translate_srt_with_progress(
+            srt_in,
+            source=source_norm,
+            target=target_norm,
+            engine=engine or DEFAULT_ENGINE,
+            nllb_endpoint=NLLB_ENDPOINT,
+            libre_endpoint=LIBRE_ENDPOINT,
+            libre_api_key=LIBRE_API_KEY,
+            progress_cb=on_progress,
+            batch_size=64,
+            http_client=app.state.http,
+        )
+    finally:
+        # Leave the UploadFile's own handle open; FastAPI closes it
+        srt_in.detach()
 
     # Mark progress as finished
     entry = _get_progress(progress_key) or {}
@@ -147,15 +209,16 @@ def translate(
     original_name = file.filename or "translated.srt"
     base_name = original_name.rsplit(".", 1)[0]
     # Remove any existing trailing language code (e.g. ".en" or ".eng") from base name
-    import re as _re
-    base_name = _re.sub(r"\.[a-z]{2,3}$", "", base_name, flags=_re.IGNORECASE)
+    head, _, tail = base_name.rpartition(".")
+    if head and 2 <= len(tail) <= 3 and tail.isascii() and tail.isalpha():
+        base_name = head
     # Use a short code (ISO 639-1 if available) for target language in filename
     short_code = target_suffix_for_filename(target_norm)
     out_filename = f"{base_name}.{short_code}.srt"
 
     # Stream the translated SRT back to the client as a file download
     return StreamingResponse(
-        iter([srt_out.encode("utf-8")]),
+        _iter_utf8_chunks(srt_out),
         media_type="application/octet-stream",
         headers={"Content-Disposition": f'attachment; filename="{out_filename}"'}
     )
@@ -170,44 +233,52 @@ async def translate_sse(key: str = ""):
         raise HTTPException(status_code=400, detail="Missing progress key")
 
     async def event_stream():
-        import asyncio, json
         last_done = None
         idle_timeout = time.time() + PROGRESS_TTL_SEC
-
-        # Initial event to ensure the client receives initial zero values
-        yield 'data: {"total":0,"done":0,"remaining":0,"finished":false}\n\n'
-
-        # Stream updates until finished or timeout
-        while time.time() < idle_timeout:
-            _gc_progress()  # cleanup stale entries periodically
-            entry = _get_progress(key)
-            if entry is None:
-                # No progress info yet, wait a bit
-                await asyncio.sleep(0.2)
-                continue
-
+        evt = asyncio.Event()
+        PROGRESS_EVENTS.setdefault(key, set()).add(evt)
+
+        try:
+            # Initial event to ensure the client receives initial zero values
+            yield _SSE_INITIAL_FRAME
+
+            # Stream updates until finished or timeout; sleep until /translate signals a change
+            while True:
+                evt.clear()
+                entry = _get_progress(key)
+                if entry is not None:
+                    total = int(entry.get("total", 0))
+                    done = int(entry.get("done", 0))
+                    finished = bool(entry.get("finished", False))
+                    remaining = max(total - done, 0)
+
+                    # Send an update if progress changed or if just finished
+                    if finished or done != last_done:
+                        yield _sse_frame(total, done, remaining, finished)
+                        last_done = done
+
+                    if finished:
+                        break  # translation completed
+
+                wait_sec = idle_timeout - time.time()
+                if wait_sec <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(evt.wait(), timeout=wait_sec)
+                except asyncio.TimeoutError:
+                    break
+
+            # Send a final complete event in case the client connected late or missed the last update
+            entry = _get_progress(key) or {"total": 0, "done": 0}
             total = int(entry.get("total", 0))
             done = int(entry.get("done", 0))
-            finished = bool(entry.get("finished", False))
             remaining = max(total - done, 0)
-
-            # Send an update if progress changed or if just finished
-            if finished or done != last_done:
-                payload = {"total": total, "done": done, "remaining": remaining, "finished": finished}
-                yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
-                last_done = done
-
-            if finished:
-                break  # translation completed
-
-            await asyncio.sleep(0.2)
-
-        # Send a final complete event in case the client connected late or missed the last update
-        entry = _get_progress(key) or {"total": 0, "done": 0}
-        total = int(entry.get("total", 0))
-        done = int(entry.get("done", 0))
-        remaining = max(total - done, 0)
-        final_payload = {"total": total, "done": done, "remaining": remaining, "finished": True}
-        yield f"data: {json.dumps(final_payload, ensure_ascii=False)}\n\n"
+            yield _sse_frame(total, done, remaining, True)
+        finally:
+            watchers = PROGRESS_EVENTS.get(key)
+            if watchers is not None:
+                watchers.discard(evt)
+                if not watchers:
+                    del PROGRESS_EVENTS[key]
 
     return StreamingResponse(event_stream(), media_type="text/event-stream")
@@ -1,8 +1,18 @@
 # srtxlate.py — SRT helpers + engines (NLLB + Libre fallback) with cue-aware batching
+import io
+import os
 import re
+import bisect
+import hashlib
+import functools
+import threading
 import unicodedata
-from typing import List, Tuple, Dict, Callable, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple, Dict, Callable, Iterator, Optional, TextIO, Union
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
 
 # -----------------------------
 # Unicode helpers
@@ -11,6 +21,16 @@ def _nfc(s: str) -> str:
     """Normalize string to NFC form."""
     return unicodedata.normalize("NFC", s or "")
 
+_RS = "\x1e"  # ASCII record separator: not produced by the engines and left alone by NFC
+
+def _nfc_many(texts: List[str]) -> List[str]:
+    """NFC-normalize many strings with a single normalize() call over a joined blob."""
+    joined = _RS.join(texts)
+    if joined.count(_RS) != len(texts) - 1:
+        # Some text already contains the separator; fall back to per-item normalization
+        return [_nfc(t) for t in texts]
+    return _nfc(joined).split(_RS)
+
 def _strip_bom(line: str) -> str:
     # Handle BOM on very first line (can break the index parse)
     return line.lstrip("\ufeff") if line else line
@@ -20,58 +40,126 @@ def _strip_bom(line: str) -> str:
 # -----------------------------
 _TAG_RE = re.compile(r"<[^>]+>")
 
-def _protect_tags(text: str) -> Tuple[str, Dict[str, str]]:
-    """Replace tags with placeholders to protect them from translation."""
-    tags: Dict[str, str] = {}
+_TAG_KEY_RE = re.compile(r"__TAG(\d+)__")
+
+def _protect_tags(text: str) -> Tuple[str, List[str]]:
+    """Replace tags with placeholders (__TAG<n>__, n = index into the returned list)."""
+    tags: List[str] = []
+    if "<" not in text:
+        return text, tags  # plain dialog: nothing to protect, skip the regex
 
     def _replace(m):
-        key = f"__TAG{len(tags)}__"
-        tags[key] = m.group(0)
-        return key
+        tags.append(m.group(0))
+        return f"__TAG{len(tags) - 1}__"
 
     protected_text = _TAG_RE.sub(_replace, text)
     return protected_text, tags
 
-def _restore_tags(text: str, tags: Dict[str, str]) -> str:
-    """Restore placeholders back to original tags."""
-    for key, val in tags.items():
-        text = text.replace(key, val)
-    return text
+def _restore_tags(text: str, tags: List[str]) -> str:
+    """Restore placeholders back to original tags in a single pass."""
+    if not tags or "__TAG" not in text:
+        return text  # nothing issued, or the model dropped every placeholder
+    def _lookup(m):
+        i = int(m.group(1))
+        # leave placeholders we never issued (model hallucinations) untouched
+        return tags[i] if i < len(tags) else m.group(0)
+
+    return _TAG_KEY_RE.sub(_lookup, text)
 
 # -----------------------------
 # SRT split/join
 # -----------------------------
-_TIME_RE = re.compile(r"\d{2}:\d{2}:\d{2},\d{3}\s*-->\s*\d{2}:\d{2}:\d{2},\d{3}")
-
-def _is_index_line(line: str) -> bool:
-    return line.strip().isdigit()
+# Anchored at the start of the line (match, not search): a timecode line begins with
+# its timestamp. No end anchor, so positional extras ("X1:40 X2:600 ...") still pass.
+_TIME_RE = re.compile(r"\s*\d{2}:\d{2}:\d{2},\d{3}\s*-->\s*\d{2}:\d{2}:\d{2},\d{3}")
 
 def _is_time_line(line: str) -> bool:
-    return bool(_TIME_RE.search(line or ""))
+    # Cheap probes first: a match needs "-->" and at least 27 chars, which rules
+    # out nearly every cue text line without entering the regex engine.
+    if not line or len(line) < 27 or "-->" not in line:
+        return False
+    return _TIME_RE.match(line) is not None
+
+# Line breaks in any convention (CRLF, CR, LF); two or more in a row end a block.
+# Matching them directly avoids normalizing (copying) the whole file up front.
+_LINE_BREAK_RE = re.compile(r"\r\n|\r|\n")
+_BLOCK_SEP_RE = re.compile(r"(?:\r\n|\r(?!\n)|\n){2,}")  # CR(?!LF): never split a CRLF in two
 
-def _split_srt(s: str) -> List[List[str]]:
+def _iter_chunks(text: str) -> Iterator[str]:
+    """Yield the pieces of text between blank-line separators, lazily."""
+    start = 0
+    for m in _BLOCK_SEP_RE.finditer(text):
+        yield text[start:m.start()]
+        start = m.end()
+    yield text[start:]
+
+def _iter_text_blocks(s: str) -> Iterator[List[str]]:
+    """Yield the raw line lists of an in-memory SRT string."""
+    for chunk in _iter_chunks(s):
+        if chunk.strip():
+            yield _LINE_BREAK_RE.split(chunk)
+
+def _iter_stream_blocks(fp: TextIO) -> Iterator[List[str]]:
     """
-    Split SRT file content into a list of blocks (each block is a list of lines).
-    Keeps indices/timestamps untouched. Handles BOM on the first line.
+    Yield the raw line lists of an SRT text stream, reading line by line.
+    Expects universal-newline decoding (the io.TextIOWrapper default).
+    Mirrors _iter_text_blocks, including the trailing empty line a file ends
+    with when it has a single final newline.
     """
-    if not s:
-        return []
-    normalized = s.replace("\r\n", "\n").replace("\r", "\n")
-    chunks = re.split(r"\n{2,}", normalized)
-    blocks: List[List[str]] = []
-    for chunk in chunks:
-        if not chunk.strip():
+    lines: List[str] = []
+    ended_with_newline = False
+    started = False
+    leading_blanks = 0
+    for raw in fp:
+        ended_with_newline = raw.endswith("\n")
+        line = raw[:-1] if ended_with_newline else raw
+        if line:
+            if not started:
+                started = True
+                # A single line break before the first content is not a separator
+                if leading_blanks == 1:
+                    lines.append("")
+            lines.append(line)
+            continue
+        if not started:
+            leading_blanks += 1
             continue
-        lines = chunk.split("\n")
+        if any(ln.strip() for ln in lines):
+            yield lines
+        lines = []
+    if any(ln.strip() for ln in lines):
+        if ended_with_newline:
+            lines.append("")
+        yield lines
+
+def _iter_srt_blocks(src: Union[str, TextIO]) -> Iterator[List[str]]:
+    """
+    Yield SRT blocks (each block is a list of lines) one at a time, so the
+    caller can group cues as it goes instead of holding every chunk first.
+    Accepts the SRT as a string or as a text stream (e.g. an upload's spooled file).
+    Keeps indices/timestamps untouched. Handles BOM on the first line.
+    """
+    if not src:
+        return
+    raw_blocks = _iter_text_blocks(src) if isinstance(src, str) else _iter_stream_blocks(src)
+    first = True
+    for lines in raw_blocks:
         # Strip BOM on the very first physical line of the file
-        if not blocks and lines:
+        if first:
             lines[0] = _strip_bom(lines[0])
-        blocks.append(lines)
-    return blocks
+            first = False
+        yield lines
 
 def _join_srt(blocks: List[List[str]]) -> str:
     """Join blocks of lines back into a single SRT string, with trailing newline."""
-    return "\n\n".join("\n".join(block) for block in blocks) + "\n"
+    buf = io.StringIO()
+    write = buf.write
+    for bi, block in enumerate(blocks):
+        if bi:
+            write("\n\n")
+        write("\n".join(block))
+    write("\n")
+    return buf.getvalue()
 
 # -----------------------------
 # Language normalization and filename suffix mapping
@@ -92,7 +180,11 @@ _alias_to_flores = {
     "bn": "ben_Beng", "ur": "urd_Arab", "ta": "tam_Taml",
     "fa": "pes_Arab", "sr": "srp_Cyrl", "hr": "hrv_Latn",
 }
+# Inverse map for filename suffixes (built once; the last alias listed for a code wins)
+_FLORES_TO_ALIAS = {v: k for k, v in _alias_to_flores.items()}
 
+# Both helpers are pure and see a tiny domain (FLORES codes + aliases), so memoize them
+@functools.lru_cache(maxsize=512)
 def normalize_lang_code(code: str) -> str:
     """
     Normalize input language code or alias to a FLORES-200 code.
@@ -104,81 +196,129 @@ def normalize_lang_code(code: str) -> str:
     return _alias_to_flores.get(code.lower(), code)
 
 # Short code for filenames (prefer ISO-639-1 where obvious)
+@functools.lru_cache(maxsize=512)
 def target_suffix_for_filename(flores_code: str) -> str:
-    inv = {v: k for k, v in _alias_to_flores.items()}
-    return inv.get(flores_code, flores_code.split("_", 1)[0][:3].lower())
+    return _FLORES_TO_ALIAS.get(flores_code, flores_code.split("_", 1)[0][:3].lower())
 
 # -----------------------------
 # Heuristics for ALL-CAPS sound/stage lines
 # -----------------------------
-# quick “no lowercase” test; tolerant to punctuation/diacritics
-_ALLCAPS_RE = re.compile(r"^[^a-zåäöæøéèáíóúñçß]+$")
-
 def _is_allcaps_marker(line: str) -> bool:
     """
     Treat short ALL-CAPS cues like [DOOR OPENS], (MUSIC), SIRENS as 'marker-ish'.
     We do not merge these with neighboring lines so they don't split a sentence.
+    "No lowercase" is txt == txt.upper(), which covers every script with case.
     """
-    txt = _TAG_RE.sub("", line or "").strip()
-    if len(txt) == 0:
+    if not line:
+        return False
+    # only pay for the tag regex when the line can contain a tag
+    txt = (_TAG_RE.sub("", line) if "<" in line else line).strip()
+    if not txt or len(txt) > 40:
         return False
-    if len(txt) <= 40 and _ALLCAPS_RE.match(txt) and any(ch.isalpha() for ch in txt):
-        return True
-    return False
+    if not any(ch.isalpha() for ch in txt):
+        return False
+    return txt == txt.upper()
 
 # -----------------------------
 # Reflow helpers (avoid mid-word splits)
 # -----------------------------
+_NEWLINE_RE = re.compile(r"\r?\n")
+
 def _split_to_n_lines_preserving_words(text: str, n: int, target_lengths: Optional[List[int]] = None) -> List[str]:
     """
-    Split 'text' into exactly n lines, preferring spaces near proportional cut points.
-    If target_lengths provided, it guides the approximate lengths per line (based on original lines).
-    Falls back to a last-resort balanced split if no spaces are available.
+    Split 'text' into exactly n lines at word boundaries.
+    If target_lengths provided, it guides the relative lengths per line (based on original lines).
+    Break points minimize the squared deviation from those targets over the whole cue
+    (Knuth-Plass style DP), so one short line is not followed by an overlong one.
+    Falls back to a greedy/hard split if there are fewer words than lines.
     """
     text = " ".join((text or "").replace("\n", " ").split())  # collapse whitespace
     if n <= 1:
         return [text]
 
-    # If we can split exactly by newlines already, do it
-    parts = [p.strip() for p in re.split(r"\r?\n", text) if p.strip()]
-    if len(parts) == n:
-        return parts
-
     total_len = max(1, len(text))
     if not target_lengths or len(target_lengths) != n:
         # proportional targets
         target_lengths = [round(total_len / n)] * n
 
+    words = text.split(" ") if text else []
+    if len(words) < n:
+        return _split_greedy(text, n, target_lengths)
+
+    # Translations rarely keep the source length; scale the hints to this text
+    avail = max(1, len(text) - (n - 1))
+    scale = avail / max(1, sum(target_lengths))
+    return _split_words_dp(words, n, [t * scale for t in target_lengths])
+
+def _split_words_dp(words: List[str], n: int, targets: List[float]) -> List[str]:
+    """Place words on exactly n non-empty lines, minimizing sum((target - width)**2)."""
+    count = len(words)
+    prefix = [0]
+    for w in words:
+        prefix.append(prefix[-1] + len(w))
+
+    inf = float("inf")
+    # cost[k][j]: best cost of words[:j] on the first k lines; back[k][j]: where line k starts
+    cost = [[inf] * (count + 1) for _ in range(n + 1)]
+    back = [[0] * (count + 1) for _ in range(n + 1)]
+    cost[0][0] = 0.0
+    for k in range(1, n + 1):
+        target = targets[k - 1]
+        prev_row, row, back_row = cost[k - 1], cost[k], back[k]
+        # line k ends after word j; leave at least one word for each later line
+        for j in range(k, count - (n - k) + 1):
+            # width of words[i:j] is end - (prefix[i] + i): letters plus joining spaces
+            end = prefix[j] + j - 1
+            best, best_i = inf, 0
+            for i in range(k - 1, j):
+                prev = prev_row[i]
+                if prev == inf:
+                    continue
+                c = prev + (target - (end - prefix[i] - i)) ** 2
+                if c < best:
+                    best, best_i = c, i
+            row[j] = best
+            back_row[j] = best_i
+
+    lines: List[str] = []
+    j = count
+    for k in range(n, 0, -1):
+        i = back[k][j]
+        lines.append(" ".join(words[i:j]))
+        j = i
+    lines.reverse()
+    return lines
+
+def _split_greedy(text: str, n: int, target_lengths: List[int]) -> List[str]:
+    """
+    Greedy split for texts with fewer words than lines: cut at the first space past
+    each target length (else the last one before it), hard-cutting when none is left.
+    """
+    # Space offsets (text is whitespace-collapsed), found once; each cut then
+    # bisects into them instead of rescanning the string from the cut point
+    spaces = [i for i, ch in enumerate(text) if ch == " "]
     out: List[str] = []
     start = 0
     for i in range(n):
-        remaining = text[start:].lstrip()
         # last piece = rest
         if i == n - 1:
-            out.append(remaining)
+            out.append(text[start:])
             break
 
-        # target cut (approx)
-        cut_target = min(len(remaining), max(1, target_lengths[i]))
-        # find nearest space around cut_target (prefer right)
-        best = None
-        # search right
-        r = remaining.find(" ", cut_target)
-        if r != -1:
-            best = r
-        # if not found right, search left
-        if best is None:
-            l = remaining.rfind(" ", 0, cut_target)
-            if l != -1:
-                best = l
-        # if still none, no spaces — do hard cut but avoid breaking multi-byte chars
-        if best is None:
-            best = cut_target
-
-        left = remaining[:best].rstrip()
-        out.append(left)
-        # move start past the space (if we cut on a space)
-        start += len(remaining[:best])
+        # target cut (approx), as an absolute offset
+        cut = start + min(len(text) - start, max(1, target_lengths[i]))
+        # nearest space at/after the cut (prefer right), else the last one before it
+        k = bisect.bisect_left(spaces, cut)
+        if k < len(spaces):
+            best = spaces[k]
+        elif k > 0 and spaces[k - 1] >= start:
+            best = spaces[k - 1]
+        else:
+            # no spaces — hard cut
+            best = cut
+
+        out.append(text[start:best].rstrip())
+        start = best
         # skip one space at boundary if present
         if start < len(text) and text[start] == " ":
             start += 1
@@ -188,9 +328,106 @@ def _split_to_n_lines_preserving_words(text: str, n: int, target_lengths: Option
         out.append("")
     return out[:n]
 
+# -----------------------------
+# HTTP session + concurrent batch dispatch (shared by the HTTP engines)
+# -----------------------------
+# Concurrent batch POSTs per translation; raise it if the NLLB server can take more
+_MAX_INFLIGHT_BATCHES = max(1, int(os.getenv("SRTXLATE_CONCURRENCY", "4")))
+
+# Batch bodies are large lists of strings; use orjson for them when it is installed.
+# (requests already asks for gzip/deflate responses by default.)
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:  # stdlib fallback
+    import json
+
+    def _dumps(obj: object) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    _loads = json.loads
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+def make_http_session() -> requests.Session:
+    """
+    Session for the NLLB/Libre backends, with a connection pool large enough
+    for several translations each keeping _MAX_INFLIGHT_BATCHES POSTs in flight.
+    Failed connects (e.g. a backend container still starting) are retried with a
+    short backoff; a POST that reached the backend is not, so no batch runs twice.
+    """
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.2)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4 * _MAX_INFLIGHT_BATCHES,
+                          max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Fallback for callers that don't pass their own session (scripts, tests), so
+# they still get keep-alive across batches instead of one connection per POST.
+_SESSION = make_http_session()
+
+def _fit(texts: List[str], n: int) -> List[str]:
+    """Pad/trim a backend response to exactly n items so slice assignment keeps alignment."""
+    short = n - len(texts)
+    if short == 0:
+        return texts
+    return list(texts[:n]) if short < 0 else list(texts) + [""] * short
+
+def _run_batches(
+    post_batch: Callable[[List[str]], List[str]],
+    lines: List[str],
+    batch_size: int,
+    progress_cb: Optional[Callable[[int, int], None]],
+) -> List[str]:
+    """
+    Send lines in batches through post_batch, keeping up to _MAX_INFLIGHT_BATCHES
+    in flight, and return the results in input order. Progress is reported as
+    each batch completes, whatever its position, always from the calling thread
+    (so progress_cb needs no locking). On failure the queued batches are
+    cancelled and the error propagates.
+    """
+    total = len(lines)
+    step = max(1, batch_size)
+    out: List[str] = [""] * total
+    done = 0
+    if progress_cb:
+        progress_cb(total, done)
+
+    starts = range(0, total, step)
+    pool = ThreadPoolExecutor(max_workers=min(_MAX_INFLIGHT_BATCHES, len(starts)))
+    try:
+        futures = {pool.submit(post_batch, lines[i : i + step]): i for i in starts}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            n = min(step, total - i)
+            out[i : i + n] = _fit(fut.result(), n)
+            done += n
+            if progress_cb:
+                progress_cb(total, done)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return out
+
 # -----------------------------
 # NLLB service call (batched)
 # -----------------------------
+@functools.lru_cache(maxsize=8)
+def _compile_glossary(terms: Tuple[Tuple[str, str], ...]) -> Tuple[Optional["re.Pattern[str]"], Dict[str, str]]:
+    """
+    Compile glossary terms into one case-insensitive whole-word alternation
+    (longest term first, so overlapping terms prefer the longer match) plus a
+    lowercase term -> replacement map for the substitution callback.
+    """
+    if not terms:
+        return None, {}
+    keys = sorted((k for k, _ in terms), key=len, reverse=True)
+    pattern = re.compile(r"\b(" + "|".join(re.escape(k) for k in keys) + r")\b", re.IGNORECASE)
+    return pattern, {k.lower(): v for k, v in terms}
+
 def _nllb_translate_batched(
     lines: List[str],
     source: str,
@@ -199,51 +436,49 @@ def _nllb_translate_batched(
     batch_size: int,
     glossary: Dict[str, str],
     progress_cb: Optional[Callable[[int, int], None]],
+    http_client: Optional[requests.Session] = None,
 ) -> List[str]:
     if not lines:
         return []
+    # Reuse the caller's pooled session (keep-alive across batches) when given
+    http = http_client or _SESSION
 
     # Protect tags + simple glossary substitutions before sending
-    protected_pairs = []
-    prepped: List[str] = []
-    for ln in lines:
-        ln0, tags = _protect_tags(ln)
-        # tiny glossary (lowercase match)
-        gtext = ln0
-        for k, v in glossary.items():
-            gtext = re.sub(rf"\b{re.escape(k)}\b", v, gtext, flags=re.IGNORECASE)
-        protected_pairs.append(tags)
-        prepped.append(gtext)
-
-    out_texts: List[str] = []
-    total = len(prepped)
-    done = 0
-    if progress_cb:
-        progress_cb(total, done)
+    gloss_re, gloss_map = _compile_glossary(tuple(glossary.items()))
+
+    def _gloss(m: "re.Match[str]") -> str:
+        return gloss_map.get(m.group(1).lower(), m.group(1))
 
-    for i in range(0, total, max(1, batch_size)):
-        batch = prepped[i : i + batch_size]
+    protected = [_protect_tags(ln) for ln in lines]
+    protected_pairs = [tags for _, tags in protected]
+    # tiny glossary (case-insensitive, whole words; one regex pass for all terms)
+    if gloss_re:
+        sub = gloss_re.sub
+        prepped: List[str] = [sub(_gloss, ln0) for ln0, _ in protected]
+    else:
+        prepped = [ln0 for ln0, _ in protected]
+
+    url = f"{nllb_endpoint.rstrip('/')}/translate"
+
+    def _post_batch(batch: List[str]) -> List[str]:
         payload = {
             "q": batch,
             "source": source,
             "target": target,
             "batch_size": batch_size,
         }
-        r = requests.post(f"{nllb_endpoint.rstrip('/')}/translate", json=payload, timeout=600)
+        r = http.post(url, data=_dumps(payload), headers=_JSON_HEADERS, timeout=600)
         r.raise_for_status()
-        data = r.json()
-        out = data.get("translatedText", [])
-        out_texts.extend(out)
-        done = min(total, done + len(batch))
-        if progress_cb:
-            progress_cb(total, done)
-
-    # Restore protected tags and normalize
-    restored_lines: List[str] = []
-    for text, tags in zip(out_texts, protected_pairs):
-        restored = _restore_tags(text, tags)
-        restored_lines.append(_nfc(restored))
-    return restored_lines
+        data = _loads(r.content)
+        return data.get("translatedText", [])
+
+    out_texts = _run_batches(_post_batch, prepped, batch_size, progress_cb)
+
+    # Restore protected tags (skipped outright when no line had any), then
+    # normalize the whole batch in one call
+    if any(protected_pairs):
+        out_texts = [_restore_tags(text, tags) for text, tags in zip(out_texts, protected_pairs)]
+    return _nfc_many(out_texts)
 
 # -----------------------------
 # LibreTranslate fallback (Argos)
@@ -255,37 +490,29 @@ def _lt_translate_batched(
     libre_endpoint: str,
     api_key: str,
     batch_size: int,
-    progress_cb: Optional[Callable[[int, int], None]]
+    progress_cb: Optional[Callable[[int, int], None]],
+    http_client: Optional[requests.Session] = None,
 ) -> List[str]:
     if not lines:
         return []
+    http = http_client or _SESSION
     # Use first two letters (ISO-639-1) for LibreTranslate if possible
     src = (source or "en")[:2]
     tgt = (target or "nb")[:2]
-    out_lines: List[str] = []
-    total_lines = len(lines)
-    done_lines = 0
-    if progress_cb:
-        progress_cb(total_lines, done_lines)
+    url = f"{libre_endpoint.rstrip('/')}/translate"
 
-    for i in range(0, total_lines, max(1, batch_size)):
-        batch = lines[i : i + batch_size]
+    def _post_batch(batch: List[str]) -> List[str]:
         payload = {"q": batch, "source": src, "target": tgt, "format": "text"}
         if api_key:
             payload["api_key"] = api_key
-        r = requests.post(f"{libre_endpoint.rstrip('/')}/translate", json=payload, timeout=600)
+        r = http.post(url, data=_dumps(payload), headers=_JSON_HEADERS, timeout=600)
         r.raise_for_status()
-        res = r.json()
+        res = _loads(r.content)
         if isinstance(res, list):
-            out_lines.extend([item.get("translatedText", "") for item in res])
-        else:
-            out_lines.extend(res.get("translatedText", []))
+            return [item.get("translatedText", "") for item in res]
+        return res.get("translatedText", [])
 
-        done_lines = min(total_lines, done_lines + len(batch))
-        if progress_cb:
-            progress_cb(total_lines, done_lines)
-
-    return out_lines
+    return _run_batches(_post_batch, lines, batch_size, progress_cb)
 
 # -----------------------------
 # Argos Translate fallback (last resort no-op)
@@ -300,13 +527,41 @@ def _argos_translate(
         progress_cb(len(lines), len(lines))
     return lines
 
+# -----------------------------
+# Cross-request translation cache
+# -----------------------------
+# (engine, source, target, digest(group text)) -> translated group text
+_TRANSLATION_CACHE: "TTLCache[Tuple[str, str, str, bytes], str]" = TTLCache(maxsize=100_000, ttl=86400)
+_TRANSLATION_CACHE_LOCK = threading.Lock()  # requests translate concurrently in the threadpool
+# SRTXLATE_TX_CACHE=0 turns it off (e.g. while comparing model or glossary changes)
+_TRANSLATION_CACHE_ENABLED = os.getenv("SRTXLATE_TX_CACHE", "1").strip() != "0"
+
+def _cache_key(engine: str, source: str, target: str, text: str) -> Tuple[str, str, str, bytes]:
+    return (engine, source, target, hashlib.blake2s(text.encode("utf-8"), digest_size=16).digest())
+
+def _cache_lookup(keys: List[Tuple[str, str, str, bytes]]) -> List[Optional[str]]:
+    if not _TRANSLATION_CACHE_ENABLED:
+        return [None] * len(keys)
+    with _TRANSLATION_CACHE_LOCK:
+        return [_TRANSLATION_CACHE.get(k) for k in keys]
+
+def _cache_store(keys: List[Tuple[str, str, str, bytes]], texts: List[str]) -> None:
+    if not _TRANSLATION_CACHE_ENABLED:
+        return
+    with _TRANSLATION_CACHE_LOCK:
+        for k, text in zip(keys, texts):
+            # blank output is a short/failed backend reply (padded by _fit), not a
+            # translation; leave it uncached so the next request retries it
+            if text and not text.isspace():
+                _TRANSLATION_CACHE[k] = text
+
 # =============================
 # Translation driver
 # =============================
 _SENTINEL = "__NL__"  # unlikely to be translated; we split on this after translation
 
 def translate_srt_with_progress(
-    srt_text: str,
+    srt_text: Union[str, TextIO],
     source: str,
     target: str,
     engine: str = "auto",
@@ -314,25 +569,31 @@ def translate_srt_with_progress(
     libre_endpoint: str = "http://libretranslate:5000",
     libre_api_key: str = "",
     progress_cb: Optional[Callable[[int, int], None]] = None,
-    batch_size: int = 64
+    batch_size: int = 64,
+    http_client: Optional[requests.Session] = None,
 ) -> str:
-    # Split into blocks
-    blocks = _split_srt(srt_text)
-
-    # Build groups to translate (only from text lines)
+    """
+    Translate SRT text (a string or a text stream), reporting (total, done)
+    through progress_cb. Each distinct text group is translated once, so total
+    counts distinct groups not found in the translation cache, not cues.
+    Pass a long-lived requests.Session as http_client to reuse pooled
+    connections to the NLLB/Libre backends across batches and requests.
+    """
+    # Build groups to translate (only from text lines), splitting blocks as we go
+    blocks: List[List[str]] = []
     groups: List[str] = []  # what we send to the engine
-    placements: List[Tuple[int, List[int]]] = []  # (block_index, [line_indexes_within_block])
+    placements: List[Tuple[int, Tuple[int, ...]]] = []  # (block_index, (line_indexes_within_block))
 
-    for bi, block in enumerate(blocks):
-        # ensure BOM removed on first line
-        if bi == 0 and block:
-            block[0] = _strip_bom(block[0])
+    # Local bindings for the per-line loops below
+    add_block, add_group, add_placement = blocks.append, groups.append, placements.append
+    is_time_line, is_marker, sep = _is_time_line, _is_allcaps_marker, f" {_SENTINEL} "
 
-        # Identify the *text* lines in the cue
+    for bi, block in enumerate(_iter_srt_blocks(srt_text)):
+        add_block(block)
+        # Identify the non-empty *text* lines in the cue (empty ones are kept as is):
+        # blank first, then the index number, and only then the timecode probe
         text_idxs = [li for li, line in enumerate(block)
-                     if not _is_index_line(line) and not _is_time_line(line) and (line is not None)]
-        # Keep empty text lines as is — nothing to translate
-        text_idxs = [li for li in text_idxs if block[li].strip() != ""]
+                     if (stripped := line.strip()) and not stripped.isdigit() and not is_time_line(line)]
 
         if not text_idxs:
             continue
@@ -341,28 +602,32 @@ def translate_srt_with_progress(
         run: List[int] = []
         for li in text_idxs:
             line = block[li]
-            if _is_allcaps_marker(line):
+            if is_marker(line):
                 if run:
-                    merged = f" {_SENTINEL} ".join(block[k] for k in run)
-                    groups.append(merged)
-                    placements.append((bi, run[:]))
+                    add_group(sep.join(block[k] for k in run))
+                    add_placement((bi, tuple(run)))
                     run.clear()
-                groups.append(line)          # marker stands alone
-                placements.append((bi, [li]))
+                add_group(line)          # marker stands alone
+                add_placement((bi, (li,)))
             else:
                 run.append(li)
 
         if run:
-            merged = f" {_SENTINEL} ".join(block[k] for k in run)
-            groups.append(merged)
-            placements.append((bi, run[:]))
+            add_group(sep.join(block[k] for k in run))
+            add_placement((bi, tuple(run)))
 
     # Nothing to translate?
     if not groups:
         return _join_srt(blocks)
 
+    # Translate each distinct group once; repeats ("Yes.", "(MUSIC)") share the result.
+    # Keyed on the stripped text: placement strips the output anyway, so "Yes." and
+    # "Yes. " (trailing space in the source file) need only one translation.
+    unique_ids: Dict[str, int] = {}
+    group_to_unique = [unique_ids.setdefault(g.strip(), len(unique_ids)) for g in groups]
+    unique_groups = list(unique_ids)
+
     use_engine = (engine or "auto").lower()
-    translated: List[str] = []
 
     # very small example glossary; adjust/remove as you like
     glossary = {
@@ -370,40 +635,72 @@ def translate_srt_with_progress(
         "removals men": "movers",
     }
 
-    # Try NLLB first (or only)
-    if use_engine in ("nllb", "auto"):
-        try:
-            translated = _nllb_translate_batched(
-                groups, normalize_lang_code(source), normalize_lang_code(target),
-                nllb_endpoint, batch_size=batch_size,
-                glossary=glossary, progress_cb=progress_cb
-            )
-        except Exception:
-            if use_engine == "nllb":
-                raise
-            translated = []
-
-    # Fallback to LibreTranslate
-    if not translated and use_engine in ("libre", "auto"):
-        try:
-            translated = _lt_translate_batched(
-                groups, source, target, libre_endpoint, libre_api_key,
-                batch_size=batch_size, progress_cb=progress_cb
-            )
-        except Exception:
-            if use_engine == "libre":
-                raise
-            translated = []
-
-    # Last resort
-    if not translated:
-        translated = _argos_translate(groups, source, target, progress_cb=progress_cb)
+    # Reuse translations cached by earlier requests; only the misses go to the engine.
+    # Progress totals therefore count the distinct, uncached groups actually sent.
+    # Entries are keyed on the engine that produced them; "auto" reads NLLB's, so a
+    # temporary Libre fallback never stands in for NLLB output on later requests.
+    src_norm, tgt_norm = normalize_lang_code(source), normalize_lang_code(target)
+    lookup_engine = "nllb" if use_engine == "auto" else use_engine
+    keys = [_cache_key(lookup_engine, src_norm, tgt_norm, g) for g in unique_groups]
+    results = _cache_lookup(keys)
+    miss_ids = [u for u, hit in enumerate(results) if hit is None]
+    pending = [unique_groups[u] for u in miss_ids]
+
+    translated: List[str] = []
+    if pending:
+        answered_by = ""
+        # Try NLLB first (or only)
+        if use_engine in ("nllb", "auto"):
+            try:
+                translated = _nllb_translate_batched(
+                    pending, src_norm, tgt_norm,
+                    nllb_endpoint, batch_size=batch_size,
+                    glossary=glossary, progress_cb=progress_cb,
+                    http_client=http_client,
+                )
+                answered_by = "nllb"
+            except Exception:
+                if use_engine == "nllb":
+                    raise
+                translated = []
+
+        # Fallback to LibreTranslate
+        if not translated and use_engine in ("libre", "auto"):
+            try:
+                translated = _lt_translate_batched(
+                    pending, source, target, libre_endpoint, libre_api_key,
+                    batch_size=batch_size, progress_cb=progress_cb,
+                    http_client=http_client,
+                )
+                answered_by = "libre"
+            except Exception:
+                if use_engine == "libre":
+                    raise
+                translated = []
+
+        # Last resort (passthrough, so never cached)
+        if not translated:
+            translated = _argos_translate(pending, source, target, progress_cb=progress_cb)
+        elif answered_by == lookup_engine:
+            _cache_store([keys[u] for u in miss_ids], translated)
+        else:
+            _cache_store([_cache_key(answered_by, src_norm, tgt_norm, g) for g in pending], translated)
+
+        # Merge engine output for the misses with the cache hits (a cold cache
+        # means every group was a miss, so the engine output is the result list)
+        if len(miss_ids) == len(results):
+            results = translated
+        else:
+            for u, text in zip(miss_ids, translated):
+                results[u] = text
+
+    # Normalize the unique results in one pass; each placement then reads its
+    # group's result by index rather than through a per-group fanned-out copy
+    normalized = _nfc_many([text or "" for text in results])
 
     # Place translated strings back into the original blocks
-    gi = 0
-    for (bi, idxs) in placements:
-        text = _nfc(translated[gi] if gi < len(translated) else "")
-        gi += 1
+    for (bi, idxs), u in zip(placements, group_to_unique):
+        text = normalized[u]
 
         # Single line: straight replace
         if len(idxs) == 1:
@@ -414,7 +711,7 @@ def translate_srt_with_progress(
         parts = [p.strip() for p in text.split(_SENTINEL)]
         if len(parts) != len(idxs):
             # If the model returned embedded newlines that match line count, accept them
-            nl_parts = [p.strip() for p in re.split(r"\r?\n", text) if p.strip()]
+            nl_parts = [p.strip() for p in _NEWLINE_RE.split(text) if p.strip()]
             if len(nl_parts) == len(idxs):
                 parts = nl_parts
             else:
@@ -1,9 +1,13 @@
 import os
 import gc
+import asyncio
+import functools
+import threading
 import unicodedata
 from typing import List, Optional, Tuple
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 import torch
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
@@ -30,14 +34,32 @@ NUM_BEAMS       = int(os.getenv("NLLB_NUM_BEAMS", "1"))
 #   passthrough: leave such cues unmodified
 SFX_POLICY = os.getenv("NLLB_SFX_POLICY", "translate_upper")
 
+# Opt-in model optimization (off by default):
+#   bettertransformer: fused attention via optimum (must be installed)
+OPTIMIZE = os.getenv("NLLB_OPTIMIZE", "").strip().lower()
+
 # --- Lazy-loaded globals ---
 _tokenizer: Optional[AutoTokenizer] = None
 _model: Optional[AutoModelForSeq2SeqLM] = None
 _loaded_model_name: Optional[str] = None  # path or hub id actually loaded
+_applied_optimize: Optional[str] = None   # NLLB_OPTIMIZE value that actually took effect
+_src_lang: Optional[str] = None  # last src_lang set on the tokenizer
 
 def nfc(s: str) -> str:
     return unicodedata.normalize("NFC", s or "")
 
+_US = "\x1f"  # unit separator: NFC-stable, never part of subtitle text
+
+def nfc_many(texts: List[str]) -> List[str]:
+    """NFC-normalize a list with one normalize() call over the joined text."""
+    if not texts:
+        return []
+    joined = _US.join(t or "" for t in texts)
+    if joined.count(_US) != len(texts) - 1:
+        # some text already contains the separator; normalize item by item
+        return [nfc(t) for t in texts]
+    return nfc(joined).split(_US)
+
 def _path_has_model(path: str) -> bool:
     if not path:
         return False
@@ -58,16 +80,34 @@ def get_model() -> Tuple[AutoTokenizer, AutoModelForSeq2SeqLM]:
     local_only = bool(use_local)
 
     tok = AutoTokenizer.from_pretrained(src, use_fast=True, local_files_only=local_only)
-    mdl = AutoModelForSeq2SeqLM.from_pretrained(src, local_files_only=local_only)
+    # Half-precision weights on the GPU: half the VRAM and memory bandwidth of fp32
+    dtype = torch.float16 if DEVICE == "cuda" else torch.float32
+    mdl = AutoModelForSeq2SeqLM.from_pretrained(src, local_files_only=local_only, torch_dtype=dtype)
 
     mdl.eval()
     if DEVICE == "cuda":
         mdl.to("cuda")
+    mdl = _optimize(mdl)
 
     _tokenizer, _model = tok, mdl
     _loaded_model_name = getattr(mdl, "name_or_path", src)
     return _tokenizer, _model
 
+def _optimize(mdl: AutoModelForSeq2SeqLM) -> AutoModelForSeq2SeqLM:
+    """Apply the NLLB_OPTIMIZE option; keep the eager model if it is unavailable."""
+    global _applied_optimize
+    if not OPTIMIZE:
+        return mdl
+    try:
+        if OPTIMIZE != "bettertransformer":
+            raise ValueError("unknown option")
+        from optimum.bettertransformer import BetterTransformer
+        mdl = BetterTransformer.transform(mdl)
+        _applied_optimize = OPTIMIZE
+    except Exception as e:
+        print(f"[nllb] NLLB_OPTIMIZE={OPTIMIZE} unavailable ({e}); using eager model")
+    return mdl
+
 class TranslateIn(BaseModel):
     q: List[str]
     source: str
@@ -79,22 +119,14 @@ class TranslateIn(BaseModel):
 class TranslateOut(BaseModel):
     translatedText: List[str]
 
-app = FastAPI(title="NLLB Translation Server", version="1.1")
+# orjson serializes the translatedText arrays much faster than the stdlib encoder
+app = FastAPI(title="NLLB Translation Server", version="1.1", default_response_class=ORJSONResponse)
 
-def _is_upper_cue(text: str) -> bool:
-    # Heuristic: predominantly uppercase letters OR surrounded by []/()
-    t = text.strip()
-    if not t:
-        return False
-    if (t.startswith('[') and t.endswith(']')) or (t.startswith('(') and t.endswith(')')):
-        inner = t[1:-1].strip()
-    else:
-        inner = t
-    letters = [c for c in inner if c.isalpha()]
-    if not letters:
-        return False
-    upper = sum(1 for c in letters if c.isupper())
-    return upper / len(letters) >= 0.8
+def _split_wrap(s: str) -> Tuple[Optional[Tuple[str, str]], str]:
+    """Return ((open, close), inner) for a []/()-wrapped cue, else (None, s)."""
+    if (s.startswith('[') and s.endswith(']')) or (s.startswith('(') and s.endswith(')')):
+        return (s[0], s[-1]), s[1:-1].strip()
+    return None, s
 
 def _prep_for_model(text: str) -> Tuple[str, dict]:
     """
@@ -105,16 +137,13 @@ def _prep_for_model(text: str) -> Tuple[str, dict]:
     """
     t = text
     info = {'upper': False, 'wrap': None}
-    s = t.strip()
-    wrap = None
-    if (s.startswith('[') and s.endswith(']')) or (s.startswith('(') and s.endswith(')')):
-        wrap = (s[0], s[-1])
-        core = s[1:-1].strip()
-    else:
-        core = s
     if SFX_POLICY == "passthrough":
         return t, info
-    if _is_upper_cue(s):
+    wrap, core = _split_wrap(t.strip())
+    # Heuristic: predominantly uppercase letters (wrapped in []/() or not);
+    # filter/map keep the per-character scan in C
+    letters = "".join(filter(str.isalpha, core))
+    if letters and sum(map(str.isupper, letters)) / len(letters) >= 0.8:
         info['upper'] = True
         if wrap:
             info['wrap'] = wrap
@@ -137,6 +166,26 @@ def _post_from_model(decoded: str, info: dict) -> str:
         out = f"{wrap[0]}{out}{wrap[1]}"
     return out
 
+@functools.lru_cache(maxsize=32)
+def _forced_bos(target: str) -> int:
+    """Forced BOS token id for a target language (FLORES code like nob_Latn)."""
+    tok, _ = get_model()
+    try:
+        forced_bos = tok.lang_code_to_id[target]
+    except Exception:
+        forced_bos = tok.convert_tokens_to_ids(target)
+    if forced_bos is None:
+        # raising keeps unsupported codes out of the cache
+        raise HTTPException(status_code=400, detail=f"Unsupported target language: {target}")
+    return forced_bos
+
+def _set_src_lang(tok: AutoTokenizer, source: str) -> None:
+    """Set src_lang if supported; skip repeats (each assignment rebuilds the special tokens)."""
+    global _src_lang
+    if source != _src_lang and hasattr(tok, "src_lang"):
+        tok.src_lang = source
+        _src_lang = source
+
 @app.get("/healthz")
 def healthz():
     return {
@@ -147,71 +196,84 @@ def healthz():
         "device": DEVICE,
         "cuda_available": torch.cuda.is_available(),
         "sfx_policy": SFX_POLICY,
+        "optimize": OPTIMIZE or None,
+        "optimize_applied": _applied_optimize,
     }
 
-@app.post("/translate", response_model=TranslateOut)
-@torch.no_grad()
-def translate(body: TranslateIn):
-    tok, mdl = get_model()
+# One model instance serves every request: model work (lazy load, the tokenizer's
+# src_lang state, generate) runs for one request at a time
+_MODEL_LOCK = threading.Lock()
 
-    # forced BOS for target language (FLORES code like nob_Latn)
-    try:
-        forced_bos = tok.lang_code_to_id[body.target]
-    except Exception:
-        forced_bos = tok.convert_tokens_to_ids(body.target)
-    if forced_bos is None:
-        raise HTTPException(status_code=400, detail=f"Unsupported target language: {body.target}")
+@app.post("/translate", response_model=TranslateOut)
+async def translate(body: TranslateIn):
+    # Prep and generation run in a worker thread, so the event loop keeps serving
+    # /healthz and accepting connections while a request is on the model
+    return TranslateOut(translatedText=await asyncio.to_thread(_translate, body))
 
+def _translate(body: TranslateIn) -> List[str]:
     max_new = int(body.max_new_tokens or MAX_NEW_TOKENS)
     beams   = int(body.num_beams or NUM_BEAMS)
     bs      = max(1, int(body.batch_size or BATCH_SIZE))
 
-    lines = [nfc(x) for x in (body.q or [])]
-    out: List[str] = []
-
-    # Optionally set src_lang if the tokenizer supports it
-    if hasattr(tok, "src_lang"):
-        tok.src_lang = body.source
-
-    i = 0
-    while i < len(lines):
-        chunk_lines = lines[i:i+bs]
-        prepped = []
-        infos = []
-        for ln in chunk_lines:
-            p, info = _prep_for_model(ln)
-            prepped.append(p if p else "")
-            infos.append(info)
+    lines = nfc_many(body.q or [])
+    prepped: List[str] = []
+    infos = []
+    for ln in lines:
+        p, info = _prep_for_model(ln)
+        prepped.append(p if p else "")
+        infos.append(info)
+
+    with _MODEL_LOCK:
+        out = _generate(prepped, infos, body.source, body.target, max_new, beams, bs)
+    return nfc_many(out)
+
+@torch.no_grad()  # grad mode is per thread, so it is set here in the worker
+def _generate(prepped: List[str], infos: List[dict], source: str, target: str,
+              max_new: int, beams: int, bs: int) -> List[str]:
+    tok, mdl = get_model()
+    forced_bos = _forced_bos(target)
+    _set_src_lang(tok, source)
+    out: List[str] = [""] * len(prepped)
+
+    # When a request spans several batches, group lines of similar token length so
+    # a single long line does not pad a whole batch; results are written back to
+    # their original positions. A request that fits one batch (the srtxlate app
+    # sends batch_size lines at a time) gains nothing, so skip the extra tokenizer pass.
+    if len(prepped) > bs:
+        lengths = [len(ids) for ids in tok(prepped, add_special_tokens=False)["input_ids"]]
+        order = sorted(range(len(prepped)), key=lengths.__getitem__)
+    else:
+        order = list(range(len(prepped)))
 
-        inputs = tok(prepped, return_tensors="pt", padding=True, truncation=True).to(DEVICE)
+    for i in range(0, len(order), bs):
+        idxs = order[i:i+bs]
+        batch = [prepped[k] for k in idxs]
 
+        inputs = tok(batch, return_tensors="pt", padding="longest", truncation=True, max_length=512)
         if DEVICE == "cuda":
-            with torch.autocast(device_type="cuda", dtype=torch.float16):
-                outputs = mdl.generate(
-                    **inputs,
-                    forced_bos_token_id=forced_bos,
-                    max_new_tokens=max_new,
-                    num_beams=beams,
-                )
-        else:
-            outputs = mdl.generate(
-                **inputs,
-                forced_bos_token_id=forced_bos,
-                max_new_tokens=max_new,
-                num_beams=beams,
-            )
+            # pinned host buffers let the host-to-device copy run without blocking the CPU
+            inputs = {k: v.pin_memory().to("cuda", non_blocking=True) for k, v in inputs.items()}
+
+        # weights are already fp16 on CUDA, so no autocast wrapper is needed
+        outputs = mdl.generate(
+            **inputs,
+            forced_bos_token_id=forced_bos,
+            max_new_tokens=max_new,
+            num_beams=beams,
+        )
 
         decoded = tok.batch_decode(outputs, skip_special_tokens=True)
-        for dec, info in zip(decoded, infos):
-            out.append(nfc(_post_from_model(dec, info)))
+        for k, dec in zip(idxs, decoded):
+            out[k] = _post_from_model(dec, infos[k])
 
         del inputs, outputs
-        if DEVICE == "cuda":
-            torch.cuda.synchronize()
-            torch.cuda.empty_cache()
-        i += bs
 
-    return TranslateOut(translatedText=out)
+    # Hand cached VRAM back once per request (not per batch: that stalls the GPU
+    # queue and makes the allocator rebuild the same workspace for every batch)
+    if DEVICE == "cuda":
+        torch.cuda.empty_cache()
+
+    return out
 
 if __name__ == "__main__":
     import uvicorn